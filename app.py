@@ -1,10 +1,14 @@
+import hashlib
 import io
 import os
 import json
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import rispy
 import streamlit as st
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from utils import *
 
@@ -36,9 +40,12 @@ How matching works:
 
 # ---- Variables and functions ----
 FUZZY_THRESHOLD = 95
+RW_COLS = ["Title", "primary_title", "Author", "RetractionNature", "Reason", "OriginalPaperDOI", "doi"]
 
-def _read_ris(uploaded_file) -> pd.DataFrame:
-    text = uploaded_file.getvalue().decode("utf-8", errors="replace")
+# cached on the uploaded bytes so widget interactions don't re-parse the file
+@st.cache_data(show_spinner="Parsing RIS…")
+def _read_ris_cached(file_bytes: bytes) -> pd.DataFrame:
+    text = file_bytes.decode("utf-8", errors="replace")
     records = rispy.load(io.StringIO(text))
     df = pd.DataFrame(records)
 
@@ -47,35 +54,123 @@ def _read_ris(uploaded_file) -> pd.DataFrame:
     if "primary_title" not in df.columns:
         df["primary_title"] = None
 
-    df = df.copy()
-    df["doi_norm"] = df["doi"].apply(normalize_doi)
-    df["title_norm"] = df["primary_title"].apply(normalize_title)
-    df["title_ok"] = df["title_norm"].apply(filter_bad_titles)
-        
+    df["doi_norm"] = normalize_doi_series(df["doi"])
+    df["title_norm"] = normalize_title_series(df["primary_title"])
+    df["title_ok"] = bad_titles_mask(df["title_norm"])
+
     return df
 
 # this function is cached to avoid re-downloading RW data too often
 @st.cache_data(ttl=24 * 3600, show_spinner="Loading Retraction Watch database…")
 def get_retraction_watch():
     rw_df, meta = load_retraction_watch()
-    rw_df = rw_df.copy()
-    rw_df["doi_norm"] = rw_df["OriginalPaperDOI"].apply(normalize_doi)
-    rw_df["title_norm"] = rw_df["Title"].apply(normalize_title)
+    rw_df["doi_norm"] = normalize_doi_series(rw_df["OriginalPaperDOI"])
+    rw_df["title_norm"] = normalize_title_series(rw_df["Title"])
+    rw_df["title_ok"] = bad_titles_mask(rw_df["title_norm"])
+    # RW repeats titles across notices; categories store each one once. RIS
+    # titles stay string: casting them to this dtype would null every title
+    # RW doesn't contain, which fuzzy matching and the Raw RIS tab still need
+    rw_df["title_norm"] = rw_df["title_norm"].astype("category")
+    meta["n_unique_dois"] = rw_df["doi_norm"].nunique()
     return rw_df, meta
 
-def _doi_url(doi: str) -> str:
-    if doi is None:
-        return ""
-    doi = str(doi).strip()
-    if doi == "" or doi.lower() == "nan":
-        return ""
-    return f"https://doi.org/{doi}"
+# read-only lookup structures reused by every matcher call; cache_resource
+# shares one object instead of unpickling a fresh copy of the (large) token
+# index on every rerun like cache_data would. Keyed on the RW download time.
+@st.cache_resource(ttl=24 * 3600, show_spinner="Indexing Retraction Watch titles…")
+def get_rw_index(rw_downloaded_on, _rw_df):
+    rw_titles_ok = _rw_df.loc[_rw_df["title_ok"], "title_norm"]
+    return {
+        "doi_norm": pd.Index(_rw_df["doi_norm"].dropna().unique()),
+        "title_norm": pd.Index(rw_titles_ok.dropna().unique()),
+        "title_tokens": build_title_index(rw_titles_ok),
+    }
+
+def _to_csv_bytes(df: pd.DataFrame) -> bytes:
+    # Arrow's C++ writer encodes straight to bytes, no intermediate str
+    buf = io.BytesIO()
+    pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
+
+# keyed on the RIS hash, RW download time and options only; the underscored
+# frames are skipped by Streamlit's hasher, so reruns that only change UI
+# state (tabs, expanders) reuse the previous results; bounded so a shared
+# server doesn't keep every upload's results around forever
+@st.cache_data(show_spinner=False, max_entries=32, ttl=24 * 3600)
+def run_matching(ris_hash, rw_downloaded_on, run_fuzzy, threshold, _review_df, _rw_df, _rw_index):
+    start = time.perf_counter()
+
+    # the two key matchers are independent; pandas' hashing releases the GIL
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        f_doi = ex.submit(match_by_doi, _review_df, _rw_df, rw_keys=_rw_index["doi_norm"])
+        f_exact = ex.submit(
+            match_by_title_exact,
+            _review_df[_review_df["title_ok"]],
+            _rw_df[_rw_df["title_ok"]],
+            rw_keys=_rw_index["title_norm"],
+        )
+        doi_matches, exact_matches = f_doi.result(), f_exact.result()
+
+    if run_fuzzy:
+        # fuzzy matching only looks for what the DOI/exact matchers missed, so
+        # records they already matched are left out of the (expensive) scoring
+        fuzzy_candidates = _review_df[
+            _review_df["title_ok"]
+            & ~_review_df["doi_norm"].isin(doi_matches["doi_norm"])
+            & ~_review_df["title_norm"].isin(exact_matches["title_norm"])
+        ]
+        fuzzy_matches = match_by_title_fuzzy(
+            fuzzy_candidates,
+            _rw_df[_rw_df["title_ok"]],
+            threshold=threshold,
+            title_index=_rw_index["title_tokens"],
+        )
+    else:
+        fuzzy_matches = pd.DataFrame()
+
+    rw_doi = doi_matches[RW_COLS]
+    rw_exact = exact_matches[RW_COLS]
+    if fuzzy_matches.empty:
+        rw_fuzzy = pd.DataFrame(columns=RW_COLS)
+    else:
+        rw_fuzzy = fuzzy_matches[RW_COLS]
+
+    # every matcher already labels its rows with match_type, so the combined
+    # table is a single concat rather than a relabelled copy of each subset
+    labelled = [doi_matches, exact_matches]
+    if not fuzzy_matches.empty:
+        labelled.append(fuzzy_matches)
+    combined = (
+        pd.concat([m[RW_COLS + ["match_type"]] for m in labelled], ignore_index=True)
+        #.drop_duplicates(subset=["doi", "Title", "match_type"])
+    )
+
+    # list-valued RIS fields aren't hashable, so stringify them before dedup
+    combined_unique = combined.copy()
+    for col in combined_unique.columns:
+        combined_unique[col] = combined_unique[col].map(
+            lambda x: repr(x) if isinstance(x, (list, dict, set, tuple)) else x
+        )
+    combined_unique = combined_unique.drop_duplicates()
+
+    return {
+        "doi": rw_doi,
+        "exact": rw_exact,
+        "fuzzy": rw_fuzzy,
+        "combined": combined,
+        "combined_unique": combined_unique,
+        "csv_bytes": _to_csv_bytes(combined),
+        # time of the actual matching run, not of a later cache hit
+        "elapsed": time.perf_counter() - start,
+    }
 
 def _prep_for_display(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    if "OriginalPaperDOI" in out.columns:
-        out["OriginalPaperDOI"] = out["OriginalPaperDOI"].apply(_doi_url)
-    return out
+    if "OriginalPaperDOI" not in df.columns:
+        return df
+    doi = df["OriginalPaperDOI"].astype("string").str.strip()
+    valid = doi.notna() & (doi != "") & (doi.str.lower() != "nan")
+    urls = ("https://doi.org/" + doi).where(valid, "").fillna("")
+    return df.assign(OriginalPaperDOI=urls)
 
 doi_col_config = {
     "OriginalPaperDOI": st.column_config.LinkColumn(
@@ -88,7 +183,7 @@ doi_col_config = {
 
 # ---- Load RW ----
 rw_df, rw_meta = get_retraction_watch()
-rw_df["title_ok"] = rw_df["title_norm"].apply(filter_bad_titles)
+rw_index = get_rw_index(rw_meta["downloaded_on"], rw_df)
 
 
 # ---- Options ----
@@ -100,7 +195,7 @@ with colB:
     if rw_meta.get("downloaded_on"):
         st.caption(f"Downloaded on: {rw_meta['downloaded_on']}")
 with colC:
-    st.metric("Unique DOIs in RW", f"{rw_df['doi_norm'].dropna().nunique():,}")
+    st.metric("Unique DOIs in RW", f"{rw_meta['n_unique_dois']:,}")
     if rw_meta.get("url"):
         with st.expander("Retraction Watch metadata", expanded=False):
             st.write({
@@ -118,7 +213,9 @@ st.info("In progress: Fuzzy title matching is optional and can be slow. Select t
 run_fuzzy = st.checkbox("Run fuzzy title matching", value=False)
 
 # ---- Load review data ----
-review_df = _read_ris(uploaded)
+ris_bytes = uploaded.getvalue()
+ris_hash = hashlib.sha256(ris_bytes).hexdigest()
+review_df = _read_ris_cached(ris_bytes)
 
 
 # ---- Quality checks ----
@@ -131,36 +228,23 @@ qc3.metric("Missing title", int(review_df["title_norm"].isna().sum()))
 # ---- Matching ----
 
 with st.spinner("Running title matching…"):
-    start = time.perf_counter()
-    
-    doi_matches = match_by_doi(review_df, rw_df)
-    exact_matches = match_by_title_exact(review_df[review_df["title_ok"]], rw_df[rw_df["title_ok"]])
-    
-    if run_fuzzy:
-        fuzzy_matches = match_by_title_fuzzy(
-            review_df[review_df["title_ok"]],
-            rw_df[rw_df["title_ok"]],
-            threshold=FUZZY_THRESHOLD,
-        )
-    else:
-        fuzzy_matches = pd.DataFrame() 
-    
-    elapsed = time.perf_counter() - start
-    
-st.success(f"Matching completed in {elapsed:.2f} seconds")
-
+    results = run_matching(
+        ris_hash,
+        rw_meta["downloaded_on"],
+        run_fuzzy,
+        FUZZY_THRESHOLD,
+        review_df,
+        rw_df,
+        rw_index,
+    )
 
-# ---- Filtering ----
+st.success(f"Matching completed in {results['elapsed']:.2f} seconds")
 
-rw_cols = ["Title", "primary_title", "Author", "RetractionNature", "Reason", "OriginalPaperDOI", "doi"]
-rw_doi = doi_matches[rw_cols].copy()
-rw_exact = exact_matches[rw_cols].copy()
+rw_doi = results["doi"]
+rw_exact = results["exact"]
+rw_fuzzy = results["fuzzy"]
+combined = results["combined"]
 
-if run_fuzzy and not fuzzy_matches.empty:
-    rw_fuzzy = fuzzy_matches[rw_cols].copy()
-else:
-    rw_fuzzy = pd.DataFrame(columns=rw_cols)
-    
 
 # ---- Summary ----
 st.subheader("Results")
@@ -176,18 +260,6 @@ res3.metric("Fuzzy title matches (excluding very short titles)", int(len(rw_fuzz
 tabs = st.tabs(["DOI matches", "Exact title matches", "Fuzzy title matches", "All matches", "Raw RIS"])
 st.caption("Title-> RW, primary_title-> RIS, OriginalPaperDOI-> RW, doi-> RIS")
 
-combined = (
-    pd.concat(
-        [
-            rw_doi.assign(match_type="doi"),
-            rw_exact.assign(match_type="title_exact"),
-            rw_fuzzy.assign(match_type="title_fuzzy"),
-        ],
-        ignore_index=True,
-    )
-    #.drop_duplicates(subset=["doi", "Title", "match_type"])
-)
-
 with tabs[0]:
     if len(rw_doi) == 0:
         st.write("No DOI matches found.")
@@ -212,14 +284,7 @@ with tabs[3]:
     if len(combined) == 0:
         st.write("No matches found.")
     else:
-        combined_unique = combined.copy()
-        for col in combined_unique.columns:
-            combined_unique[col] = combined_unique[col].map(
-            lambda x: repr(x) if isinstance(x, (list, dict, set, tuple)) else x
-        )
-
-        combined_unique = combined_unique.drop_duplicates()
-        st.dataframe(_prep_for_display(combined_unique), use_container_width=True, column_config=doi_col_config)
+        st.dataframe(_prep_for_display(results["combined_unique"]), use_container_width=True, column_config=doi_col_config)
 
 with tabs[4]:
     st.dataframe(review_df, use_container_width=True)
@@ -228,10 +293,9 @@ with tabs[4]:
 # ---- Download ----
 st.subheader("Download")
 
-csv_bytes = combined.to_csv(index=False).encode("utf-8")
 st.download_button(
     "Download matched Retraction Watch rows (CSV)",
-    data=csv_bytes,
+    data=results["csv_bytes"],
     file_name="retraction_watch_matches.csv",
     mime="text/csv",
 )
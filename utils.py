@@ -1,16 +1,18 @@
-import os
-import json
-import re
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
+from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from rapidfuzz import process, fuzz
-import requests
 
 
 RW_URL = "https://gitlab.com/crossref/retraction-watch-data/-/raw/main/retraction_watch.csv"
+RW_CACHE_PATH = Path("~/.cache/rw/retraction_watch.parquet").expanduser()
+RW_CACHE_TTL = 24 * 3600
 
-BAD_TITLES = {
+BAD_TITLES = frozenset({
     "editorial",
     "index",
     "correction",
@@ -21,14 +23,31 @@ BAD_TITLES = {
     "commentary",
     "letter",
     "news",
+})
+
+# string patterns on purpose: pandas only hands these to Arrow's RE2 engine
+# (compiled patterns fall back to per-element Python re), and RE2's \w/\s
+# are ASCII-only, so spell out Python's Unicode \w and \s
+_PAT_DASH = r"[\/\-–—]"
+_PAT_WS = r"[\s\p{Z}\x{0b}\x{1c}-\x{1f}\x{85}]+"
+_PAT_PUNCT = r"[^\p{L}\p{N}_\s\p{Z}\x{0b}\x{1c}-\x{1f}\x{85}]"
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "by", "for", "from", "in",
+    "into", "is", "its", "of", "on", "or", "the", "to", "via", "with",
 }
 
 
 def load_retraction_watch():
-    rw_df = pd.read_csv(RW_URL)
+    # reuse a local parquet copy for a day instead of re-downloading the CSV
+    rw_df, downloaded_on = _read_rw_cache()
+    if rw_df is None:
+        rw_df = pd.read_csv(RW_URL, engine="pyarrow", dtype_backend="pyarrow")
+        downloaded_on = datetime.utcnow()
+        _write_rw_cache(rw_df)
 
     metadata = {
-        "downloaded_on": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S UTC"),
+        "downloaded_on": downloaded_on.strftime("%Y-%m-%d %H:%M:%S UTC"),
         "n_records": len(rw_df),
         "source": "Retraction Watch public GitHub CSV",
         "url": RW_URL
@@ -37,48 +56,59 @@ def load_retraction_watch():
     return rw_df, metadata
 
 
-# Cleaning
-def normalize_doi(doi):
-    if doi is None or pd.isna(doi):
-        return None
+def _read_rw_cache():
+    cache_mtime = RW_CACHE_PATH.stat().st_mtime if RW_CACHE_PATH.exists() else 0
+    if time.time() - cache_mtime >= RW_CACHE_TTL:
+        return None, None
 
-    doi = str(doi).lower().strip()
+    try:
+        rw_df = pd.read_parquet(RW_CACHE_PATH, dtype_backend="pyarrow")
+    except (OSError, ValueError, pa.ArrowException):
+        # corrupt or unreadable (e.g. written by another pyarrow); re-download
+        RW_CACHE_PATH.unlink(missing_ok=True)
+        return None, None
 
-    if doi in {"", "nan", "none"}:
-        return None
+    return rw_df, datetime.utcfromtimestamp(cache_mtime)
 
-    return (
-        doi
-        .replace("https://doi.org/", "")
-        .replace("http://doi.org/", "")
-        .replace("http://dx.doi.org/", "")
-        #.replace(".pub2", "")
-        .replace("doi:", "")
-        .strip()
-        or None
-    )
 
+def _write_rw_cache(rw_df):
+    tmp_path = RW_CACHE_PATH.with_suffix(".parquet.tmp")
+    try:
+        RW_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        rw_df.to_parquet(tmp_path, compression="zstd")
+        tmp_path.replace(RW_CACHE_PATH)
+    except (OSError, ValueError, TypeError):
+        # the cache is an optimisation only; fall back to downloading next time
+        tmp_path.unlink(missing_ok=True)
 
-def normalize_title(title):
-    if title is None or pd.isna(title):
-        return None
 
-    title = title.lower()
-    title = re.sub(r"[\/\-–—]", " ", title)
-    title = re.sub(r"\s+", " ", title)
-    title = re.sub(r"[^\w\s]", "", title)
+# Cleaning
+def normalize_doi_series(s):
+    doi = (
+        s.astype("string[pyarrow]")
+        .str.lower()
+        .str.strip()
+        .str.replace(r"^(https?://(dx\.)?doi\.org/|doi:)", "", regex=True)
+        .str.strip()
+    )
+    # mask rather than replace(..., None), which would fall back to object dtype
+    return doi.mask(doi.isin(["", "nan", "none"]))
 
-    return title.strip()
+
+def normalize_title_series(s):
+    return (
+        s.astype("string[pyarrow]")
+        .str.lower()
+        .str.replace(_PAT_DASH, " ", regex=True)
+        .str.replace(_PAT_PUNCT, "", regex=True)
+        .str.replace(_PAT_WS, " ", regex=True)
+        .str.strip()
+    )
 
 
-def filter_bad_titles(title_norm, min_len=10):
-    if not title_norm:
-        return False
-    if title_norm in BAD_TITLES:
-        return False
-    if len(title_norm) < min_len:
-        return False
-    return True
+def bad_titles_mask(s, min_len=10):
+    ok = s.notna() & (s.str.len() >= min_len) & ~s.isin(BAD_TITLES)
+    return ok.fillna(False).astype(bool)
 
 
 # Checks
@@ -92,9 +122,13 @@ def report_basic_checks(df):
     print()
 
 
-def match_by_doi(review_df, rw_df, key="doi_norm"):
-    left = review_df.dropna(subset=[key]).copy()
-    right = rw_df.dropna(subset=[key]).copy()
+def match_by_doi(review_df, rw_df, key="doi_norm", rw_keys=None):
+    if rw_keys is None:
+        rw_keys = pd.Index(rw_df[key].dropna().unique())
+
+    # filter both sides down to shared keys so the merge only sees hits
+    left = review_df[rw_keys.get_indexer(review_df[key]) >= 0]
+    right = rw_df[rw_df[key].isin(left[key])]
 
     matched = left.merge(
         right,
@@ -109,9 +143,13 @@ def match_by_doi(review_df, rw_df, key="doi_norm"):
     matched["match_type"] = "doi"
     return matched
 
-def match_by_title_exact(review_df, rw_df, key="title_norm"):
-    left = review_df.dropna(subset=[key]).copy()
-    right = rw_df.dropna(subset=[key]).copy()
+def match_by_title_exact(review_df, rw_df, key="title_norm", rw_keys=None):
+    if rw_keys is None:
+        rw_keys = pd.Index(rw_df[key].dropna().unique())
+
+    # filter both sides down to shared keys so the merge only sees hits
+    left = review_df[rw_keys.get_indexer(review_df[key]) >= 0]
+    right = rw_df[rw_df[key].isin(left[key])]
 
     matched = left.merge(
         right,
@@ -128,41 +166,81 @@ def match_by_title_exact(review_df, rw_df, key="title_norm"):
 
 
 
-def match_by_title_fuzzy(review_df, rw_df, key="title_norm", threshold=90):
-    rw_titles = rw_df[key].dropna().astype(str).unique().tolist()
+def build_title_index(titles, min_token_len=3):
+    titles = np.asarray(pd.Series(titles).dropna().astype(str).unique(), dtype=object)
+
+    token_to_idx = {}
+    for i, title in enumerate(titles):
+        for token in set(title.split()):
+            if len(token) >= min_token_len and token not in STOPWORDS:
+                token_to_idx.setdefault(token, []).append(i)
 
-    def best_match(title):
-        if title is None or pd.isna(title):
-            return (None, None)
+    token_to_idx = {
+        token: np.asarray(idx, dtype=np.int32) for token, idx in token_to_idx.items()
+    }
+    return titles, token_to_idx
 
-        title = str(title).strip()
-        if not title:
-            return (None, None)
 
-        res = process.extractOne(
-            title,
-            rw_titles,
-            scorer=fuzz.token_sort_ratio,
-            score_cutoff=threshold,
-        )
-        if not res:
-            return (None, None)
+def _title_candidates(title, token_to_idx, n_tokens=2):
+    # blocking: only compare against RW titles sharing one of the rarest tokens
+    tokens = [t for t in set(title.split()) if t in token_to_idx]
+    rarest = sorted(tokens, key=lambda t: len(token_to_idx[t]))[:n_tokens]
+    if not rarest:
+        return np.empty(0, dtype=np.int32)
+    return np.unique(np.concatenate([token_to_idx[t] for t in rarest]))
 
-        match, score, *_ = res
-        return (match, score)
 
-    df = review_df.copy()
-    df[["matched_title_norm", "title_score"]] = df[key].apply(
-        lambda t: pd.Series(best_match(t))
-    )
+def match_by_title_fuzzy(review_df, rw_df, key="title_norm", threshold=90, title_index=None):
+    if title_index is None:
+        title_index = build_title_index(rw_df[key])
+    rw_titles, token_to_idx = title_index
+
+    matched = review_df.dropna(subset=[key])
 
-    matched = df.dropna(subset=["matched_title_norm"]).copy()
+    if matched.empty or len(rw_titles) == 0:
+        return pd.DataFrame()
+
+    # score each distinct review title once, then broadcast back to the rows
+    review_titles, review_inverse = np.unique(
+        matched[key].astype(str).to_numpy(dtype=object), return_inverse=True
+    )
+    best_titles = np.full(len(review_titles), None, dtype=object)
+    best_scores = np.zeros(len(review_titles), dtype=np.uint8)
+
+    for i, title in enumerate(review_titles):
+        candidates = _title_candidates(title, token_to_idx)
+        if len(candidates) == 0:
+            continue
+
+        # score_cutoff lets rapidfuzz skip pairs whose length bound already
+        # falls short; those (and any other misses) come back as 0
+        scores = process.cdist(
+            review_titles[i:i + 1],
+            rw_titles[candidates],
+            scorer=fuzz.token_sort_ratio,
+            score_cutoff=threshold,
+            dtype=np.uint8,
+        )[0]
+        j = scores.argmax()
+        best_titles[i] = rw_titles[candidates[j]]
+        best_scores[i] = scores[j]
+
+    best_titles = best_titles[review_inverse]
+    best_scores = best_scores[review_inverse]
+    mask = (best_scores >= threshold) & (best_scores > 0)
+
+    matched = matched[mask].assign(
+        matched_title_norm=best_titles[mask],
+        title_score=best_scores[mask],
+    )
 
     if matched.empty:
         return pd.DataFrame()
 
+    # join back only against the RW rows carrying a matched title
+    rw_hits = rw_df[rw_df[key].isin(matched["matched_title_norm"])]
     merged = matched.merge(
-        rw_df,
+        rw_hits,
         left_on="matched_title_norm",
         right_on=key,
         how="inner",